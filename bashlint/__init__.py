@@ -2,9 +2,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import sys
-if sys.version_info > (3, 0):
-    from six.moves import xrange
+import array
 
 from bashlint import bparser, grammar, tokenizer
 from bashlint import bash, lint, nast
@@ -182,7 +180,7 @@ def ast2tokens(node, loose_constraints=False, ignore_flag_order=False,
                     tokens += to_tokens_fun(child)
             else:
                 tokens.append("\\(")
-                for i in xrange(len(node.children)-1):
+                for i in range(len(node.children)-1):
                     tokens += to_tokens_fun(node.children[i])
                 tokens += to_tokens_fun(node.children[-1])
                 tokens.append("\\)")
@@ -263,51 +261,90 @@ def ast2list(node, order='dfs', _list=None, ignore_flag_order=False,
     """
     Linearize the AST.
     """
+    if _list is None:
+        _list = []
     if order == 'dfs':
-        if node.is_argument() and node.is_open_vocab() and arg_type_only:
-            token = node.arg_type
-        elif node.is_option() and with_flag_head:
-            token = node.utility.value + '@@' + node.value if node.utility \
-                else node.value
-        else:
-            token = node.value
-        if with_prefix:
-            token = node.prefix + token
-        _list.append(token)
-        if node.get_num_of_children() > 0:
-            if node.is_utility() and ignore_flag_order:
-                children = sorted(node.children, key=lambda x:x.value)
-            else:
-                children = node.children
-            for child in children:
-                ast2list(child, order, _list, ignore_flag_order, arg_type_only,
-                         keep_common_args, with_flag_head, with_prefix)
-            _list.append(nast._H_NO_EXPAND)
-        else:
-            _list.append(nast._V_NO_EXPAND)
+        _linearize_ast(node, _list.append, ignore_flag_order, arg_type_only,
+                       with_flag_head, with_prefix)
     return _list
 
 
+def ast2ids(node, vocab, unk_id=None, order='dfs', _ids=None,
+            ignore_flag_order=False, arg_type_only=False,
+            keep_common_args=False, with_flag_head=False, with_prefix=False):
+    """
+    Linearize the AST into a contiguous array of (int32) vocabulary indices.
+
+    The tokens are indexed as the tree is walked, without building the token
+    list first. Pass the same array as _ids to accumulate several ASTs and
+    dump them at once with _ids.tofile().
+
+    :param vocab: dictionary which maps the tokens of the linearized AST to
+        their indices.
+    :param unk_id: index of the tokens not in the vocabulary. If not set,
+        such tokens are added to the vocabulary instead.
+    """
+    if _ids is None:
+        _ids = array.array('i')
+
+    def emit_id(token):
+        token_id = vocab.get(token, unk_id)
+        if token_id is None:
+            token_id = vocab[token] = len(vocab)
+        _ids.append(token_id)
+
+    if order == 'dfs':
+        _linearize_ast(node, emit_id, ignore_flag_order, arg_type_only,
+                       with_flag_head, with_prefix)
+    return _ids
+
+
+def _linearize_ast(node, emit, ignore_flag_order, arg_type_only,
+                   with_flag_head, with_prefix):
+    """
+    Depth-first walk shared by ast2list and ast2ids, which passes the token
+    of every node and the end-of-children markers to emit.
+    """
+    if node.is_argument() and node.is_open_vocab() and arg_type_only:
+        token = node.arg_type
+    elif node.is_option() and with_flag_head:
+        token = node.utility.value + '@@' + node.value if node.utility \
+            else node.value
+    else:
+        token = node.value
+    if with_prefix:
+        token = node.prefix + token
+    emit(token)
+    if node.get_num_of_children() > 0:
+        if node.is_utility() and ignore_flag_order:
+            children = sorted(node.children, key=lambda x:x.value)
+        else:
+            children = node.children
+        for child in children:
+            _linearize_ast(child, emit, ignore_flag_order, arg_type_only,
+                           with_flag_head, with_prefix)
+        emit(_H_NO_EXPAND)
+    else:
+        emit(_V_NO_EXPAND)
+
+
 def utility_stats(u):
     return bg[u].num_compound_flags
 
 
 def get_utilities(ast):
-    def get_utilities_fun(node):
-        utilities = set([])
+    utilities = set([])
+    if not ast:
+        return utilities
+    stack = [ast]
+    while stack:
+        node = stack.pop()
         if node.is_utility():
             utilities.add(node.value)
-            for child in node.children:
-                utilities = utilities.union(get_utilities_fun(child))
-        elif not node.is_argument():
-            for child in node.children:
-                utilities = utilities.union(get_utilities_fun(child))
-        return utilities
-
-    if not ast:
-        return set([])
-    else:
-        return get_utilities_fun(ast)
+        elif node.is_argument():
+            continue
+        stack.extend(node.children)
+    return utilities
 
 
 def clean_and_normalize(cm):
@@ -22,12 +22,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
 import copy
+import functools
 import os
 import re
-import sys
-if sys.version_info > (3, 0):
-    from six.moves import xrange
 
 # bash grammar
 from bashlint.grammar import *
@@ -38,7 +37,10 @@ from bashlint.nast import *
 
 from nlp_tools import constants
 
+_TAR_FIX_RE = re.compile(r' tar (\w)')
 
+
+@functools.lru_cache(maxsize=16384)
 def clean_and_normalize(cmd):
     # special normalization for certain commands
     ## remove all "sudo"'s
@@ -70,29 +72,18 @@ def clean_and_normalize(cmd):
     cmd = cmd.replace("\\(-", "\\( -")
     cmd = cmd.replace("e\\)", "e \\)")
     cmd = cmd.replace("-\\!", "!")
-    try:
-        cmd = cmd.replace("— ", "-")
-        cmd = cmd.replace("–", "-")
-        cmd = cmd.replace("—", "-")
-        cmd = cmd.replace("“", '"')
-        cmd = cmd.replace("”", '"')
-        cmd = cmd.replace("-\xd0\xbe", "-o")
-        cmd = cmd.replace("\xe2\x80\x93 ", "-")
-        cmd = cmd.replace('‘', '\'')
-        cmd = cmd.replace('’', '\'')
-    except UnicodeDecodeError:
-        cmd = cmd.replace("— ".decode('utf-8'), "-")
-        cmd = cmd.replace("–".decode('utf-8'), "-")
-        cmd = cmd.replace("—".decode('utf-8'), "-")
-        cmd = cmd.replace("“".decode('utf-8'), '"')
-        cmd = cmd.replace("”".decode('utf-8'), '"')
-        cmd = cmd.replace("\xd0\xbe".decode('utf-8'), "o")
-        cmd = cmd.replace("\xe2\x80\x93 ".decode('utf-8') , "-")
-        cmd = cmd.replace('‘'.decode('utf-8'), '\'')
-        cmd = cmd.replace('’'.decode('utf-8'), '\'')
+    cmd = cmd.replace("— ", "-")
+    cmd = cmd.replace("–", "-")
+    cmd = cmd.replace("—", "-")
+    cmd = cmd.replace("“", '"')
+    cmd = cmd.replace("”", '"')
+    cmd = cmd.replace("-\xd0\xbe", "-o")
+    cmd = cmd.replace("\xe2\x80\x93 ", "-")
+    cmd = cmd.replace('‘', '\'')
+    cmd = cmd.replace('’', '\'')
 
     # more typo fixes
-    cmd = re.sub("-prin($| )", '-print', cmd)
+    cmd = re.sub(r"-prin($| )", '-print', cmd)
     cmd = cmd.replace("/bin/echo", "echo")
     cmd = cmd.replace(" exec sed ", " -exec sed ")
     cmd = cmd.replace(" xargs -iname ", " xargs ")
@@ -104,20 +95,18 @@ def clean_and_normalize(cmd):
 
     ## remove shell character
     if cmd.startswith("$ "):
-        cmd = re.sub("^\$ ", '', cmd)
+        cmd = re.sub(r"^\$ ", '', cmd)
     if cmd.startswith("# "):
-        cmd = re.sub("^\# ", '', cmd)
+        cmd = re.sub(r"^\# ", '', cmd)
     if cmd.startswith("$find "):
-        cmd = re.sub("^\$find ", "find ", cmd)
+        cmd = re.sub(r"^\$find ", "find ", cmd)
     if cmd.startswith("#find "):
-        cmd = re.sub("^\#find ", "find ", cmd)
+        cmd = re.sub(r"^\#find ", "find ", cmd)
 
     ## the first argument of "tar" is always interpreted as an option
-    tar_fix = re.compile(' tar \w')
     if cmd.startswith('tar'):
         cmd = ' ' + cmd
-    for w in re.findall(tar_fix, cmd):
-        cmd = cmd.replace(w, w.replace(' tar ', ' tar -'))
+    cmd = re.sub(_TAR_FIX_RE, r' tar -\1', cmd)
     cmd = cmd.strip()
 
     return cmd
@@ -143,6 +132,11 @@ def detach_from_tree(node, parent):
     node.lsb = None
 
 
+# exceptions signaling that bashlex cannot parse a command
+_BASHLEX_ERRORS = (tokenizer.MatchedPairError, errors.ParsingError,
+                   NotImplementedError, IndexError, AttributeError,
+                   AssertionError, NameError, TypeError)
+
 def safe_bashlex_parse(cmd, start_pos=0, verbose=False):
     """
     Call bashlex with all exceptions properly catched.
@@ -157,41 +151,11 @@ def safe_bashlex_parse(cmd, start_pos=0, verbose=False):
         tree = bparser.parse(cmd)
         if start_pos > 0:
             increment_bashlex_tree_offset(tree[0], start_pos)
-    except tokenizer.MatchedPairError:
-        if verbose:
-            print("Bashlex cannot parse: %s - MatchedPairError" % cmd)
-        return None
-    except errors.ParsingError:
-        if verbose:
-            print("Bashlex cannot parse: %s - ParsingError" % cmd)
-        return None
-    except NotImplementedError:
-        if verbose:
-            print("Bashlex cannot parse: %s - NotImplementedError" % cmd)
-        return None
-    except IndexError:
-        if verbose:
-            print("Bashlex cannot parse: %s - IndexError" % cmd)
-        # empty command
-        return None
-    except AttributeError:
-        if verbose:
-            print("Bashlex cannot parse: %s - AttributeError" % cmd)
-        # not a bash command
-        return None
-    except AssertionError:
-        if verbose:
-            print("Bashlex cannot parse: %s - AssertionError" % cmd)
-        # not a bash command
-        return None
-    except NameError:
-        if verbose:
-            print("Bashlex cannot parse: %s - NameError" % cmd)
-        # not a bash command
-        return None
-    except TypeError:
+    except _BASHLEX_ERRORS as err:
+        # IndexError: empty command
+        # AttributeError, AssertionError, NameError: not a bash command
         if verbose:
-            print("Bashlex cannot parse: %s - AssertionError" % cmd)
+            print("Bashlex cannot parse: %s - %s" % (cmd, type(err).__name__))
         return None
     if len(tree) > 1:
         if verbose:
@@ -199,554 +163,550 @@ def safe_bashlex_parse(cmd, start_pos=0, verbose=False):
         return None
     return tree
 
-def normalize_ast(cmd, recover_quotes=True, verbose=False):
-    """
-    Convert the bashlex parse tree of a command into the normalized form.
-
-    :param cmd: bash command to parse
-    :param recover_quotes: if set, retain quotation marks in the command
-    :param verbose: if set, print error message.
-    :return normalized_tree
-    """
-    cmd = cmd.replace('\n', ' ').strip()
-    cmd = clean_and_normalize(cmd)
-    if not cmd:
-        return None
-
-    def is_unary_logic_op(node, parent):
-        if node.word == "!":
-            return parent and parent.is_command("find")
-        return node.word in bash.right_associate_unary_logic_operators \
-               or node.word in bash.left_associate_unary_logic_operators
-
-    def is_binary_logic_op(node, parent):
-        if node.word == '-o':
-            if parent and parent.is_command("find"):
-                node.word = "-or"
-                return True
-            else:
-                return False
-        if node.word == '-a':
-            if parent and parent.is_command("find"):
-                node.word = "-and"
-                return True
-            else:
-                return False
-        if node.word == ',':
-            if parent and parent.is_command("find"):
-                node.word = "-and"
-                return True
-            else:
-                return False
-        return node.word in bash.binary_logic_operators
+_UNARY_LOGIC_OPERATORS = frozenset(
+    bash.right_associate_unary_logic_operators |
+    bash.left_associate_unary_logic_operators)
+
+# short forms which are binary logic operators only in "find" commands
+_FIND_BINARY_LOGIC_OPERATORS = {
+    '-o': '-or',
+    '-a': '-and',
+    ',': '-and'
+}
+
+_PARENTHESES = frozenset(['(', ')', '\\(', '\\)'])
+
+def _is_unary_logic_op(node, parent):
+    if node.word == "!":
+        return parent and parent.is_command("find")
+    return node.word in _UNARY_LOGIC_OPERATORS
+
+def _is_binary_logic_op(node, parent):
+    if node.word in _FIND_BINARY_LOGIC_OPERATORS:
+        if parent and parent.is_command("find"):
+            node.word = _FIND_BINARY_LOGIC_OPERATORS[node.word]
+            return True
+        else:
+            return False
+    return node.word in bash.binary_logic_operators
 
-    def is_parenthesis(node, parent):
-        if node.word in ['(', ')', '\\(', '\\)']:
-            if parent and parent.is_command('find'):
-                return True
-            else:
-                return False
+def _is_parenthesis(node, parent):
+    if node.word in _PARENTHESES:
+        if parent and parent.is_command('find'):
+            return True
+        else:
+            return False
 
-    def recover_node_quotes(node):
-        return cmd[node.pos[0] : node.pos[1]]
+def _recover_node_quotes(node, ctx):
+    return ctx.cmd[node.pos[0] : node.pos[1]]
 
-    def normalize_word(node, recover_quotes=True):
-        w = recover_node_quotes(node) if recover_quotes else node.word
-        return w
+def _normalize_word(node, ctx, recover_quotes=True):
+    w = _recover_node_quotes(node, ctx) if recover_quotes else node.word
+    return w
 
-    def normalize_argument(node, current, arg_type):
-        value = normalize_word(node, recover_quotes)
-        norm_node = ArgumentNode(value=value, arg_type=arg_type)
-        attach_to_tree(norm_node, current)
-        return norm_node
+def _normalize_argument(node, current, arg_type, ctx):
+    value = _normalize_word(node, ctx, ctx.recover_quotes)
+    norm_node = ArgumentNode(value=value, arg_type=arg_type)
+    attach_to_tree(norm_node, current)
+    return norm_node
 
-    def normalize_command(node, current=None):
-        bash_grammar = BashGrammar()
-        bash_grammar.name2type = bg.name2type
+def _normalize_command(node, current, ctx):
+    bash_grammar = BashGrammar()
+    bash_grammar.name2type = bg.name2type
 
-        if not node or not node.parts:
-            return
-        input = node.parts
-        num_tokens = len(node.parts)
-
-        bast_node = input[0]
-        if bast_node.kind == 'assignment':
-            normalize(bast_node, current, 'assignment')
-        elif bast_node.kind == 'redirect':
-            normalize(bast_node, current, 'redirect')
-        elif bast_node.kind == 'commandsubstitution':
-            normalize(bast_node, current, 'commandsubstitution')
-        elif bast_node.kind == 'word' and not bast_node.parts:
-            token = normalize_word(bast_node)
-            head = UtilityNode(token, parent=current, lsb=current.get_right_child())
-            if current:
-                current.add_child(head)
-
-            # If utility grammar is not known, parse into a simple two-level tree
-            if not bg.consume(token):
-                raise errors.LintParsingError(
-                    "Warning: grammar not found - utility {}".format(token), num_tokens, 0)
-                for bast_node in input[1:]:
-                    if bast_node.kind == 'word' and (not bast_node.parts
-                            or (bast_node.parts[0].kind == 'parameter' and
-                                bast_node.word.startswith('-'))):
-                        token = normalize_word(bast_node)
-                        if token.startswith('-'):
-                            child = FlagNode(token, parent=head, lsb=head.get_right_child())
-                        else:
-                            child = ArgumentNode(token, arg_type='Unknown', parent=head,
-                                                 lsb=head.get_right_child())
-                        head.add_child(child)
+    if not node or not node.parts:
+        return
+    input = node.parts
+    num_tokens = len(node.parts)
+
+    bast_node = input[0]
+    if bast_node.kind == 'assignment':
+        _normalize(bast_node, current, ctx, 'assignment')
+    elif bast_node.kind == 'redirect':
+        _normalize(bast_node, current, ctx, 'redirect')
+    elif bast_node.kind == 'commandsubstitution':
+        _normalize(bast_node, current, ctx, 'commandsubstitution')
+    elif bast_node.kind == 'word' and not bast_node.parts:
+        token = _normalize_word(bast_node, ctx)
+        head = UtilityNode(token, parent=current, lsb=current.get_right_child())
+        if current:
+            current.add_child(head)
+
+        # If utility grammar is not known, parse into a simple two-level tree
+        if not bg.consume(token):
+            raise errors.LintParsingError(
+                "Warning: grammar not found - utility {}".format(token), num_tokens, 0)
+            for bast_node in input[1:]:
+                if bast_node.kind == 'word' and (not bast_node.parts
+                        or (bast_node.parts[0].kind == 'parameter' and
+                            bast_node.word.startswith('-'))):
+                    token = _normalize_word(bast_node, ctx)
+                    if token.startswith('-'):
+                        child = FlagNode(token, parent=head, lsb=head.get_right_child())
                     else:
-                        normalize(bast_node, head)
-                return
+                        child = ArgumentNode(token, arg_type='Unknown', parent=head,
+                                             lsb=head.get_right_child())
+                    head.add_child(child)
+                else:
+                    _normalize(bast_node, head, ctx)
+            return
 
-            current, i = head, 1
-            bash_grammar.grammar = {head.value: copy.deepcopy(bg.grammar[head.value])}
-            bash_grammar.consume(head.value)
-
-            while i < len(input):
-                bast_node = input[i]
-                # '--': signal the end of options
-                if bast_node.kind == 'word' and bast_node.word == '--':
-                    op = OperatorNode('--', parent=current, lsb=current.get_right_child())
-                    current.add_child(op)
-                    bash_grammar.push('--', OPERATOR_S)
-                    i += 1
-                    continue
-                # examine each possible next states in order
-                matched = False
-                for next_state in bash_grammar.next_states:
-                    if next_state.is_compound_flag():
-                        # Next state is a flag
-                        if bast_node.kind != 'word' or (bast_node.parts and not (
-                                bast_node.word.startswith('-') and
-                                    bast_node.parts[0].kind == 'parameter')):
-                            continue
-                        if is_parenthesis(bast_node, current):
-                            flag = FlagNode(bast_node.word, parent=current,
-                                            lsb=current.get_right_child())
-                            current.add_child(flag)
-                            matched = True
-                            i += 1
-                            break
-                        elif is_unary_logic_op(bast_node, current):
-                            flag = UnaryLogicOpNode(bast_node.word, parent=current,
-                                                    lsb=current.get_right_child())
-                            current.add_child(flag)
-                            matched = True
-                            i += 1
-                            break
-                        elif is_binary_logic_op(bast_node, current):
-                            flag = BinaryLogicOpNode(bast_node.word, parent=current,
-                                                     lsb=current.get_right_child())
-                            current.add_child(flag)
+        current, i = head, 1
+        bash_grammar.grammar = {head.value: copy.deepcopy(bg.grammar[head.value])}
+        bash_grammar.consume(head.value)
+
+        while i < len(input):
+            bast_node = input[i]
+            is_word = bast_node.kind == 'word'
+            # '--': signal the end of options
+            if is_word and bast_node.word == '--':
+                op = OperatorNode('--', parent=current, lsb=current.get_right_child())
+                current.add_child(op)
+                bash_grammar.push('--', OPERATOR_S)
+                i += 1
+                continue
+            # a word without sub-parts is taken verbatim
+            is_simple_word = is_word and not bast_node.parts
+            # a word which can be a flag, e.g. '-n' or '-$OPT'
+            is_flag_word = is_simple_word or (is_word and
+                bast_node.word.startswith('-') and
+                    bast_node.parts[0].kind == 'parameter')
+            # examine each possible next states in order
+            matched = False
+            for next_state in bash_grammar.next_states:
+                if next_state.is_compound_flag():
+                    # Next state is a flag
+                    if not is_flag_word:
+                        continue
+                    if _is_parenthesis(bast_node, current):
+                        flag = FlagNode(bast_node.word, parent=current,
+                                        lsb=current.get_right_child())
+                        current.add_child(flag)
+                        matched = True
+                        i += 1
+                        break
+                    elif _is_unary_logic_op(bast_node, current):
+                        flag = UnaryLogicOpNode(bast_node.word, parent=current,
+                                                lsb=current.get_right_child())
+                        current.add_child(flag)
+                        matched = True
+                        i += 1
+                        break
+                    elif _is_binary_logic_op(bast_node, current):
+                        flag = BinaryLogicOpNode(bast_node.word, parent=current,
+                                                 lsb=current.get_right_child())
+                        current.add_child(flag)
+                        matched = True
+                        i += 1
+                        break
+                    else:
+                        token = _normalize_word(bast_node, ctx)
+                        try:
+                            result = bash_grammar.push(token, COMPOUND_FLAG_S)
+                        except ValueError as e:
+                            raise errors.FlagError(e.args[0], num_tokens, i)
+                        if result:
+                            for flag_token, flag_arg in result:
+                                flag = FlagNode(flag_token, parent=current,
+                                                lsb=current.get_right_child())
+                                current.add_child(flag)
+                                if flag_arg == '__OPEN__':
+                                    # Incomplete AST, expecting flag argument
+                                    current = flag
+                                elif flag_arg is not None:
+                                    # Argument is specified with flag
+                                    argument = ArgumentNode(flag_arg[0], arg_type=flag_arg[1],
+                                        parent=flag, lsb=flag.get_right_child())
+                                    flag.add_child(argument)
                             matched = True
                             i += 1
                             break
-                        else:
-                            token = normalize_word(bast_node)
-                            try:
-                                result = bash_grammar.push(token, COMPOUND_FLAG_S)
-                            except ValueError as e:
-                                raise errors.FlagError(e.args[0], num_tokens, i)
-                            if result:
-                                for flag_token, flag_arg in result:
-                                    flag = FlagNode(flag_token, parent=current,
-                                                    lsb=current.get_right_child())
-                                    current.add_child(flag)
-                                    if flag_arg == '__OPEN__':
-                                        # Incomplete AST, expecting flag argument
-                                        current = flag
-                                    elif flag_arg is not None:
-                                        # Argument is specified with flag
-                                        argument = ArgumentNode(flag_arg[0], arg_type=flag_arg[1],
-                                            parent=flag, lsb=flag.get_right_child())
-                                        flag.add_child(argument)
-                                matched = True
-                                i += 1
-                                break
-                    elif next_state.is_command():
-                        # Next state is a nested bash command
-                        new_command_node = bast.node(
-                            kind="command", word="", parts=[], pos=(-1,-1))
-                        if next_state.type == ARG_COMMAND_S:
-                            if bast_node.kind == 'word' and not bast_node.parts:
-                                token = normalize_word(bast_node)
-                                if constants.with_quotation(token):
-                                    subcommand = token[1:-1]
-                                    start_pos = bast_node.pos[0] + 1
-                                    tree = safe_bashlex_parse(subcommand, start_pos=start_pos,
-                                                              verbose=verbose)
-                                    if tree is None:
-                                        raise errors.SubCommandError(
-                                            'Error in subcommand string: {}'.format(token),
-                                            num_tokens, i)
-                                    normalize(tree[0], current)
-                                    bash_grammar.push(token, next_state.type)
-                                    i += 1
-                                else:
-                                    continue 
-                            else:
-                                normalize(bast_node, current, 'command')
+                elif next_state.is_command():
+                    # Next state is a nested bash command
+                    new_command_node = bast.node(
+                        kind="command", word="", parts=[], pos=(-1,-1))
+                    if next_state.type == ARG_COMMAND_S:
+                        if is_simple_word:
+                            token = _normalize_word(bast_node, ctx)
+                            if constants.with_quotation(token):
+                                subcommand = token[1:-1]
+                                start_pos = bast_node.pos[0] + 1
+                                tree = safe_bashlex_parse(subcommand, start_pos=start_pos,
+                                                          verbose=ctx.verbose)
+                                if tree is None:
+                                    raise errors.SubCommandError(
+                                        'Error in subcommand string: {}'.format(token),
+                                        num_tokens, i)
+                                _normalize(tree[0], current, ctx)
+                                bash_grammar.push(token, next_state.type)
                                 i += 1
-                        elif next_state.type == EXEC_COMMAND_S:
-                            new_input = []
-                            j = i
-                            while j < len(input):
-                                if hasattr(input[j], 'word') and \
-                                        input[j].word in next_state.stop_tokens:
-                                    break
-                                else:
-                                    new_input.append(input[j])
-                                    j += 1
-                            new_command_node.parts = new_input
-                            normalize_command(new_command_node, current)
-                            if j < len(input):
-                                current.value += ('::' + input[j].word)
-                                bash_grammar.push(input[j], EXEC_COMMAND_S)
                             else:
-                                if verbose:
-                                    print("Warning: -exec missing stop token - ; added")
-                                current.value += ('::' + ';')
-                                bash_grammar.push(';', EXEC_COMMAND_S)
-                            i = j + 1
+                                continue 
                         else:
-                            # Interpret all of the rest of the tokens as content of the nested command
-                            new_command_node.parts = input[i:]
-                            normalize_command(new_command_node, current)
-                            bash_grammar.push('', next_state.type)
-                            i = len(input)
-                        current = current.utility
-                        matched = True
-                        break
-                    elif next_state.is_argument():
-                        # Next state is an argument
-                        if bast_node.kind == 'word' and not bast_node.parts:
-                            token = normalize_word(bast_node)
-                            if next_state.is_list and next_state.list_separator != ' ':
-                                list_separator = next_state.list_separator
-                                argument = ArgumentNode(token, arg_type=next_state.arg_type,
-                                    parent=current, lsb=current.get_right_child(),
-                                    list_members=token.split(list_separator),
-                                    list_separator=list_separator)
+                            _normalize(bast_node, current, ctx, 'command')
+                            i += 1
+                    elif next_state.type == EXEC_COMMAND_S:
+                        new_input = []
+                        j = i
+                        while j < len(input):
+                            if hasattr(input[j], 'word') and \
+                                    input[j].word in next_state.stop_tokens:
+                                break
                             else:
-                                argument = ArgumentNode(token, arg_type=next_state.arg_type,
-                                    parent=current, lsb=current.get_right_child())
-                            current.add_child(argument)
-                            status = bash_grammar.push(token, ARG_S)
+                                new_input.append(input[j])
+                                j += 1
+                        new_command_node.parts = new_input
+                        _normalize_command(new_command_node, current, ctx)
+                        if j < len(input):
+                            current.value += ('::' + input[j].word)
+                            bash_grammar.push(input[j], EXEC_COMMAND_S)
                         else:
-                            normalize(bast_node, current, next_state.arg_type)
-                            status = bash_grammar.push('', ARG_S)
-                        if status != '__SAME_PARENT__':
-                            current = current.utility
-                        i += 1
-                        matched = True
-                        break
-
-                if not matched:
-                    if bast_node.kind == 'redirect' or bast_node.kind == 'operator':
-                        i += 1
-                        matched = True
+                            if ctx.verbose:
+                                print("Warning: -exec missing stop token - ; added")
+                            current.value += ('::' + ';')
+                            bash_grammar.push(';', EXEC_COMMAND_S)
+                        i = j + 1
+                    else:
+                        # Interpret all of the rest of the tokens as content of the nested command
+                        new_command_node.parts = input[i:]
+                        _normalize_command(new_command_node, current, ctx)
+                        bash_grammar.push('', next_state.type)
+                        i = len(input)
+                    current = current.utility
+                    matched = True
+                    break
+                elif next_state.is_argument():
+                    # Next state is an argument
+                    if is_simple_word:
+                        token = _normalize_word(bast_node, ctx)
+                        if next_state.is_list and next_state.list_separator != ' ':
+                            list_separator = next_state.list_separator
+                            argument = ArgumentNode(token, arg_type=next_state.arg_type,
+                                parent=current, lsb=current.get_right_child(),
+                                list_members=token.split(list_separator),
+                                list_separator=list_separator)
+                        else:
+                            argument = ArgumentNode(token, arg_type=next_state.arg_type,
+                                parent=current, lsb=current.get_right_child())
+                        current.add_child(argument)
+                        status = bash_grammar.push(token, ARG_S)
                     else:
-                        raise errors.LintParsingError('Unmatched token', num_tokens, i)
+                        _normalize(bast_node, current, ctx, next_state.arg_type)
+                        status = bash_grammar.push('', ARG_S)
+                    if status != '__SAME_PARENT__':
+                        current = current.utility
+                    i += 1
+                    matched = True
+                    break
 
-            if bash_grammar.allow_eof():
-                post_process_command(head)
-                return
-            else:
-                raise errors.LintParsingError('Incomplete command', num_tokens, i)
+            if not matched:
+                if bast_node.kind in ['redirect', 'operator']:
+                    i += 1
+                    matched = True
+                else:
+                    raise errors.LintParsingError('Unmatched token', num_tokens, i)
+
+        if bash_grammar.allow_eof():
+            _post_process_command(head)
+            return
         else:
-            if bast_node.parts:
-                normalize(bast_node, current)
-            else:
-                raise errors.LintParsingError(
-                    'Utility needs to be a BAST node of "Word" type" {}'.format(bast_node),
-                    num_tokens, 0)
-
-    def post_process_command(head):
-        # process (embedded) parenthese -- treat as implicit "-and"
-        def organize_buffer(lparenth, rparenth):
-            node = lparenth
+            raise errors.LintParsingError('Incomplete command', num_tokens, i)
+    else:
+        if bast_node.parts:
+            _normalize(bast_node, current, ctx)
+        else:
+            raise errors.LintParsingError(
+                'Utility needs to be a BAST node of "Word" type" {}'.format(bast_node),
+                num_tokens, 0)
+
+def _post_process_command(head):
+    # process (embedded) parenthese -- treat as implicit "-and"
+    def organize_buffer(lparenth, rparenth):
+        node = lparenth
+        while node != rparenth:
+            node = node.rsb
+        node = lparenth.rsb
+        if node.rsb == rparenth:
+            return lparenth.rsb
+        else:
+            norm_node = BracketNode()
             while node != rparenth:
+                attach_to_tree(node, norm_node)
                 node = node.rsb
-            node = lparenth.rsb
-            if node.rsb == rparenth:
-                return lparenth.rsb
-            else:
-                norm_node = BracketNode()
-                while node != rparenth:
-                    attach_to_tree(node, norm_node)
-                    node = node.rsb
-                return norm_node
+            return norm_node
 
-        stack = []
-        depth = 0
+    stack = []
+    depth = 0
 
-        def pop_stack_content(depth, rparenth, stack_top=None):
-            # popping pushed states off the stack
+    def pop_stack_content(depth, rparenth, stack_top=None):
+        # popping pushed states off the stack
+        popped = stack.pop()
+        buffered = []
+        while (popped.value != "("):
+            buffered.append(popped)
             popped = stack.pop()
-            while (popped.value != "("):
-                head.remove_child(popped)
-                popped = stack.pop()
-            lparenth = popped
-            if not rparenth:
-                # unbalanced brackets
-                rparenth = ArgumentNode(value=")")
-                make_parent_child(stack_top.parent, rparenth)
-                make_sibling(stack_top, rparenth)
-            new_child = organize_buffer(lparenth, rparenth)
-            i = head.substitute_parentheses(
-                lparenth, rparenth, new_child)
-            depth -= 1
+        head.remove_children(buffered)
+        lparenth = popped
+        if not rparenth:
+            # unbalanced brackets
+            rparenth = ArgumentNode(value=")")
+            make_parent_child(stack_top.parent, rparenth)
+            make_sibling(stack_top, rparenth)
+        new_child = organize_buffer(lparenth, rparenth)
+        i = head.substitute_parentheses(
+            lparenth, rparenth, new_child)
+        depth -= 1
+        if depth > 0:
+            # embedded parenthese
+            stack.append(new_child)
+        return depth, i
+
+    i = 0
+    while i < head.get_num_of_children():
+        child = head.children[i]
+        if child.value == "(":
+            stack.append(child)
+            depth += 1
+        elif child.value == ")":
+            assert(depth >= 0)
+            # fix imbalanced parentheses: missing '('
+            if depth == 0:
+                # simply drop the single ')'
+                detach_from_tree(child, child.parent)
+            else:
+                depth, i = pop_stack_content(depth, child)
+        else:
             if depth > 0:
-                # embedded parenthese
-                stack.append(new_child)
-            return depth, i
-
-        i = 0
-        while i < head.get_num_of_children():
-            child = head.children[i]
-            if child.value == "(":
                 stack.append(child)
-                depth += 1
-            elif child.value == ")":
-                assert(depth >= 0)
-                # fix imbalanced parentheses: missing '('
-                if depth == 0:
-                    # simply drop the single ')'
-                    detach_from_tree(child, child.parent)
-                else:
-                    depth, i = pop_stack_content(depth, child)
-            else:
-                if depth > 0:
-                    stack.append(child)
-
-            i += 1
-
-        # fix imbalanced parentheses: missing ')'
-        while (depth > 0):
-            depth, _ = pop_stack_content(depth, None, stack[-1])
-
-        assert(len(stack) == 0)
-        assert(depth == 0)
-
-        # recover omitted arguments
-        if head.value == "find":
-            arguments = []
-            for child in head.children:
-                if child.is_argument():
-                    arguments.append(child)
-            if head.get_num_of_children() > 0 and len(arguments) < 1:
-                norm_node = ArgumentNode(value=".", arg_type="Path")
-                make_sibling(norm_node, head.children[0])
-                norm_node.parent = head
-                head.children.insert(0, norm_node)
-
-        # "grep" normalization
-        if head.value == "egrep":
-            head.value = "grep"
-            flag_present = False
-            for child in head.children:
-                if child.is_option() and child.value in ["-E", "--extended-regexp"]:
-                    flag_present = True
-            if not flag_present:
-                norm_node = FlagNode(value="-E")
-                if head.has_children():
-                    make_sibling(norm_node, head.children[0])
-                norm_node.parent = head
-                head.children.insert(0, norm_node)
-
-        if head.value == "fgrep":
-            head.value = "grep"
-            flag_present = False
-            for child in head.children:
-                if child.is_option() and child.value in ["-F", "--fixed-strings"]:
-                    flag_present = True
-            if not flag_present:
-                norm_node = FlagNode(value="-F")
-                if head.has_children():
-                    make_sibling(norm_node, head.children[0])
-                norm_node.parent = head
-                head.children.insert(0, norm_node)
-
-        # "xargs" normalization
-        def normalize_replace_str(node, r_str, n_str):
-            for child in node.children:
-                if child.is_argument():
-                    if r_str in child.value:
-                        child.value = child.value.replace(r_str, n_str)
-                        if child.value == n_str:
-                            child.arg_type = "ReservedWord"
-                else:
-                    normalize_replace_str(child, r_str, n_str)
-
-        has_repl_str = False
-        if head.value == "xargs":
-            for flag in head.get_flags():
-                if flag.value == "-I":
-                    has_repl_str = True
-                    repl_str = flag.get_argument()
-                    assert(repl_str is not None)
-                    if repl_str.value != "{}":
-                        utility = head.get_subcommand()
-                        assert(utility is not None)
-                        normalize_replace_str(utility, repl_str.value, '{}')
-                        repl_str.value = "{}"
-                        repl_str.arg_type = "ReservedWord"
-
-            # add -I {} if not present
-            utility = head.get_subcommand()
-            if not has_repl_str and utility is not None:
-                for i in xrange(head.get_num_of_children()):
-                    if head.children[i].is_utility():
-                        repl_str_flag_node = FlagNode("-I")
-                        repl_str_node = ArgumentNode("{}", "ReservedWord")
-                        repl_str_node2 = ArgumentNode("{}", "ReservedWord")
-
-                        head.children.insert(i, repl_str_flag_node)
-                        repl_str_flag_node.parent = head
-                        repl_str_flag_node.lsb = head.children[i-1]
-                        head.children[i-1].rsb = repl_str_flag_node
-
-                        make_parent_child(repl_str_flag_node, repl_str_node)
-                        sub_command = head.children[i+1]
-                        repl_str_node2.parent = sub_command
-                        repl_str_node2.lsb = sub_command.get_right_child()
-                        sub_command.children.append(repl_str_node2)
-                        break
 
-    def normalize(node, current, arg_type=""):
-        # recursively normalize each subtree
-        if not type(node) is bast.node:
-            raise ValueError('type(node) is not bast.node')
-        if node.kind == 'word':
-            # assign fine-grained types
-            if node.parts:
-                # Compound arguments
-                # commandsubstitution, processsubstitution, parameter
-                if node.parts[0].kind == "processsubstitution":
-                    if '>' in node.word:
-                        norm_node = ProcessSubstitutionNode('>')
-                        attach_to_tree(norm_node, current)
-                        for child in node.parts:
-                            normalize(child, norm_node)
-                    elif '<' in node.word:
-                        norm_node = ProcessSubstitutionNode('<')
-                        attach_to_tree(norm_node, current)
-                        for child in node.parts:
-                            normalize(child, norm_node)
-                elif node.parts[0].kind == "commandsubstitution":
-                    norm_node = CommandSubstitutionNode()
-                    attach_to_tree(norm_node, current)
-                    for child in node.parts:
-                        normalize(child, norm_node)
-                elif (node.parts[0].kind == "parameter" or
-                      node.parts[0].kind == "tilde"):
-                    normalize_argument(node, current, arg_type)
-                else:
-                    for child in node.parts:
-                        normalize(child, current)
+        i += 1
+
+    # fix imbalanced parentheses: missing ')'
+    while (depth > 0):
+        depth, _ = pop_stack_content(depth, None, stack[-1])
+
+    assert(len(stack) == 0)
+    assert(depth == 0)
+
+    # recover omitted arguments
+    if head.value == "find":
+        arguments = []
+        for child in head.children:
+            if child.is_argument():
+                arguments.append(child)
+        if head.get_num_of_children() > 0 and len(arguments) < 1:
+            norm_node = ArgumentNode(value=".", arg_type="Path")
+            make_sibling(norm_node, head.children[0])
+            norm_node.parent = head
+            head.children.insert(0, norm_node)
+
+    # "grep" normalization
+    if head.value == "egrep":
+        head.value = "grep"
+        flag_present = False
+        for child in head.children:
+            if child.is_option() and child.value in ["-E", "--extended-regexp"]:
+                flag_present = True
+        if not flag_present:
+            norm_node = FlagNode(value="-E")
+            if head.has_children():
+                make_sibling(norm_node, head.children[0])
+            norm_node.parent = head
+            head.children.insert(0, norm_node)
+
+    if head.value == "fgrep":
+        head.value = "grep"
+        flag_present = False
+        for child in head.children:
+            if child.is_option() and child.value in ["-F", "--fixed-strings"]:
+                flag_present = True
+        if not flag_present:
+            norm_node = FlagNode(value="-F")
+            if head.has_children():
+                make_sibling(norm_node, head.children[0])
+            norm_node.parent = head
+            head.children.insert(0, norm_node)
+
+    # "xargs" normalization
+    def normalize_replace_str(node, r_str, n_str):
+        for child in node.children:
+            if child.is_argument():
+                if r_str in child.value:
+                    child.value = child.value.replace(r_str, n_str)
+                    if child.value == n_str:
+                        child.arg_type = "ReservedWord"
             else:
-                normalize_argument(node, current, arg_type)
-        elif node.kind == "pipeline":
-            norm_node = PipelineNode()
-            attach_to_tree(norm_node, current)
-            if len(node.parts) % 2 == 0:
-                raise ValueError("Error: pipeline node must have odd number of parts (%d)"
-                      % len(node.parts))
-            for child in node.parts:
-                if child.kind == "command":
-                    normalize(child, norm_node)
-                elif not child.kind == "pipe":
-                    raise ValueError(
-                        "Error: unrecognized type of child of pipeline node")
-        elif node.kind == "list":
-            if len(node.parts) > 2:
-                # multiple commands, not supported
-                raise ValueError("Unsupported: list of length >= 2")
+                normalize_replace_str(child, r_str, n_str)
+
+    has_repl_str = False
+    if head.value == "xargs":
+        for flag in head.get_flags():
+            if flag.value == "-I":
+                has_repl_str = True
+                repl_str = flag.get_argument()
+                assert(repl_str is not None)
+                if repl_str.value != "{}":
+                    utility = head.get_subcommand()
+                    assert(utility is not None)
+                    normalize_replace_str(utility, repl_str.value, '{}')
+                    repl_str.value = "{}"
+                    repl_str.arg_type = "ReservedWord"
+
+        # add -I {} if not present
+        utility = head.get_subcommand()
+        if not has_repl_str and utility is not None:
+            for i in range(head.get_num_of_children()):
+                if head.children[i].is_utility():
+                    repl_str_flag_node = FlagNode("-I")
+                    repl_str_node = ArgumentNode("{}", "ReservedWord")
+                    repl_str_node2 = ArgumentNode("{}", "ReservedWord")
+
+                    head.children.insert(i, repl_str_flag_node)
+                    repl_str_flag_node.parent = head
+                    repl_str_flag_node.lsb = head.children[i-1]
+                    head.children[i-1].rsb = repl_str_flag_node
+
+                    make_parent_child(repl_str_flag_node, repl_str_node)
+                    sub_command = head.children[i+1]
+                    repl_str_node2.parent = sub_command
+                    repl_str_node2.lsb = sub_command.get_right_child()
+                    sub_command.children.append(repl_str_node2)
+                    break
+
+def _normalize_word_node(node, current, ctx, arg_type):
+    # assign fine-grained types
+    if node.parts:
+        # Compound arguments
+        # commandsubstitution, processsubstitution, parameter
+        head_kind = node.parts[0].kind
+        if head_kind == "processsubstitution":
+            if '>' in node.word:
+                norm_node = ProcessSubstitutionNode('>')
+            elif '<' in node.word:
+                norm_node = ProcessSubstitutionNode('<')
             else:
-                normalize(node.parts[0], current)
-        elif node.kind == "commandsubstitution" or \
-             node.kind == "processsubstitution":
-            normalize(node.command, current)
-        elif node.kind == "command":
-            try:
-                normalize_command(node, current)
-            except AssertionError:
-                raise AssertionError("normalized_command AssertionError")
-        elif hasattr(node, 'parts'):
+                return
+        elif head_kind == "commandsubstitution":
+            norm_node = CommandSubstitutionNode()
+        elif head_kind == "parameter" or head_kind == "tilde":
+            _normalize_argument(node, current, arg_type, ctx)
+            return
+        else:
             for child in node.parts:
-                # skip current node
-                normalize(child, current)
-        elif node.kind == "redirect":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "operator":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "parameter":
-            # not supported
-            raise ValueError("Unsupported: parameters")
-        elif node.kind == "compound":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "list":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "for":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "if":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "while":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "until":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "assignment":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "function":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "tilde":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
-        elif node.kind == "heredoc":
-            # not supported
-            raise ValueError("Unsupported: %s" % node.kind)
+                _normalize(child, current, ctx)
+            return
+        attach_to_tree(norm_node, current)
+        for child in node.parts:
+            _normalize(child, norm_node, ctx)
+    else:
+        _normalize_argument(node, current, arg_type, ctx)
+
+def _normalize_pipeline(node, current, ctx, arg_type):
+    norm_node = PipelineNode()
+    attach_to_tree(norm_node, current)
+    if len(node.parts) % 2 == 0:
+        raise ValueError("Error: pipeline node must have odd number of parts (%d)"
+              % len(node.parts))
+    for child in node.parts:
+        if child.kind == "command":
+            _normalize(child, norm_node, ctx)
+        elif not child.kind == "pipe":
+            raise ValueError(
+                "Error: unrecognized type of child of pipeline node")
+
+def _normalize_list(node, current, ctx, arg_type):
+    if len(node.parts) > 2:
+        # multiple commands, not supported
+        raise ValueError("Unsupported: list of length >= 2")
+    else:
+        _normalize(node.parts[0], current, ctx)
+
+def _normalize_substitution(node, current, ctx, arg_type):
+    _normalize(node.command, current, ctx)
+
+def _normalize_command_node(node, current, ctx, arg_type):
+    try:
+        _normalize_command(node, current, ctx)
+    except AssertionError:
+        raise AssertionError("normalized_command AssertionError")
+
+_NORMALIZERS = {
+    'word': _normalize_word_node,
+    'pipeline': _normalize_pipeline,
+    'list': _normalize_list,
+    'commandsubstitution': _normalize_substitution,
+    'processsubstitution': _normalize_substitution,
+    'command': _normalize_command_node
+}
+
+# bashlex node kinds which are not supported by the normalizer
+_UNSUPPORTED_KINDS = frozenset([
+    'redirect', 'operator', 'parameter', 'compound', 'for', 'if', 'while',
+    'until', 'assignment', 'function', 'tilde', 'heredoc'
+])
+
+# exceptions signaling that a bashlex tree cannot be normalized
+_NORMALIZATION_ERRORS = (ValueError, AttributeError, AssertionError,
+                         errors.SubCommandError, errors.LintParsingError,
+                         errors.FlagError)
+
+# command being normalized and the normalization options
+_NormalizationContext = collections.namedtuple(
+    '_NormalizationContext', ['cmd', 'recover_quotes', 'verbose'])
+
+def _normalize(node, current, ctx, arg_type=""):
+    # recursively normalize each subtree
+    if not type(node) is bast.node:
+        raise ValueError('type(node) is not bast.node')
+    normalizer = _NORMALIZERS.get(node.kind)
+    if normalizer is not None:
+        normalizer(node, current, ctx, arg_type)
+    elif hasattr(node, 'parts'):
+        for child in node.parts:
+            # skip current node
+            _normalize(child, current, ctx)
+    elif node.kind in _UNSUPPORTED_KINDS:
+        raise ValueError("Unsupported: %s" % node.kind)
+
+def normalize_ast(cmd, recover_quotes=True, verbose=False):
+    """
+    Convert the bashlex parse tree of a command into the normalized form.
+
+    :param cmd: bash command to parse
+    :param recover_quotes: if set, retain quotation marks in the command
+    :param verbose: if set, print error message.
+    :return normalized_tree
+    """
+    if verbose:
+        # the memoized trees are built silently, normalize from scratch so
+        # that the error messages are printed on every call
+        return _normalize_ast(cmd, recover_quotes, verbose)
+    # the normalized trees are memoized, hand out a copy which the caller is
+    # free to modify
+    normalized_tree = _memoized_normalize_ast(cmd, recover_quotes)
+    if normalized_tree is None:
+        return None
+    return normalized_tree.clone()
+
+@functools.lru_cache(maxsize=16384)
+def _memoized_normalize_ast(cmd, recover_quotes):
+    return _normalize_ast(cmd, recover_quotes, False)
+
+def _normalize_ast(cmd, recover_quotes, verbose):
+    cmd = cmd.replace('\n', ' ').strip()
+    cmd = clean_and_normalize(cmd)
+    if not cmd:
+        return None
 
     tree = safe_bashlex_parse(cmd, verbose=verbose)
     if tree is None:
         return tree
 
     normalized_tree = Node(kind="root")
+    ctx = _NormalizationContext(cmd, recover_quotes, verbose)
     try:
-        normalize(tree[0], normalized_tree)
-    except ValueError as err:
-        if verbose:
-            print("%s - %s" % (err.args[0], cmd))
-        return None
-    except AttributeError as err:
-        if verbose:
-            print("%s - %s" % (err.args[0], cmd))
-        return None
-    except AssertionError as err:
-        if verbose:
-            print("%s - %s" % (err.args[0], cmd))
-        return None
-    except errors.SubCommandError as err:
-        if verbose:
-            print("%s - %s" % (err.args[0], cmd))
-        return None
-    except errors.LintParsingError as err:
-        if verbose:
-            print("%s - %s" % (err.args[0], cmd))
-        return None
-    except errors.FlagError as err:
+        _normalize(tree[0], normalized_tree, ctx)
+    except _NORMALIZATION_ERRORS as err:
         if verbose:
             print("%s - %s" % (err.args[0], cmd))
         return None
@@ -758,111 +718,159 @@ def normalize_ast(cmd, recover_quotes=True, verbose=False):
 
     return normalized_tree
 
+def _serialize_plain_flag(node):
+    """
+    Serialize a flag whose children are all leaf arguments, return None for
+    any other flag.
+    """
+    for child in node.children:
+        if child.kind != 'argument' or child.children:
+            return None
+    if '::' in node.value:
+        value, op = node.value.split('::')
+        fragments = [value]
+        fragments.extend(child.value for child in node.children)
+        fragments.append("\\;" if op == ';' else op)
+        return ' '.join(fragments).strip()
+    if not node.children:
+        return node.value.strip()
+    arg_connector = '=' if node.is_long_option() else ' '
+    return (node.value + arg_connector +
+            ' '.join(child.value for child in node.children)).strip()
+
 def serialize_ast(node, loose_constraints=False, ignore_flag_order=False):
+    """
+    Convert a normalized AST back into a bash command.
+
+    The tree is walked with an explicit stack holding the nodes yet to be
+    expanded, the string fragments to be emitted after them and the start
+    positions (int) of the fragment sequences to be stripped as a whole. All
+    fragments go to a single list which is joined once at the end; flags
+    and arguments without subtrees are serialized in place instead of being
+    pushed onto the stack.
+    """
     if not node:
         return ''
 
     lc = loose_constraints
     ifo = ignore_flag_order
 
-    def to_command_fun(node):
-        str = ''
-        if node.is_root():
-            assert(loose_constraints or node.get_num_of_children() == 1)
+    parts = []
+    stack = [node]
+    # bound methods of the two lists touched for every fragment
+    emit, push, pop = parts.append, stack.append, stack.pop
+    while stack:
+        node = pop()
+        node_type = type(node)
+        if node_type is str:
+            emit(node)
+            continue
+        if node_type is int:
+            stripped = ''.join(parts[node:]).strip()
+            del parts[node:]
+            emit(stripped)
+            continue
+        kind = node.kind
+        children = node.children
+        if kind == 'argument':
+            assert(lc or not children)
+            emit(node.value)
             if lc:
-                for child in node.children:
-                    str += to_command_fun(child)
-            else:
-                str += to_command_fun(node.get_left_child())
-        elif node.kind == 'pipeline':
-            assert(loose_constraints or node.get_num_of_children() > 1)
-            if lc and node.get_num_of_children() < 1:
-                str += ''
-            elif lc and node.get_num_of_children() == 1:
-                str += to_command_fun(node.get_left_child())
+                stack.extend(reversed(children))
+        elif kind == 'flag':
+            assert(lc or node.parent)
+            flag_str = _serialize_plain_flag(node)
+            if flag_str is not None:
+                emit(flag_str)
+                continue
+            push(len(parts))
+            if '::' in node.value:
+                value, op = node.value.split('::')
+                emit(value + ' ')
+                push(("\\;" if op == ';' else op) + ' ')
             else:
-                for child in node.children[:-1]:
-                    str += to_command_fun(child)
-                    str += ' | '
-                str += to_command_fun(node.get_right_child())
-        elif node.kind == "commandsubstitution":
-            assert(loose_constraints or node.get_num_of_children() == 1)
-            if lc and node.get_num_of_children() < 1:
-                str += ''
+                emit(node.value + ('=' if node.is_long_option() else ' '))
+            for child in reversed(children):
+                push(' ')
+                push(child)
+        elif kind == 'utility':
+            if ifo:
+                children = sorted(children, key=lambda x:x.value)
+            # the leading plain arguments and flags are serialized in place,
+            # the rest of the children go through the stack
+            fragments = [node.value]
+            for i, child in enumerate(children):
+                if child.kind == 'argument' and not child.children:
+                    fragments.append(child.value)
+                elif child.kind == 'flag':
+                    assert(lc or child.parent)
+                    flag_str = _serialize_plain_flag(child)
+                    if flag_str is None:
+                        break
+                    fragments.append(flag_str)
+                else:
+                    break
             else:
-                str += '$('
-                str += to_command_fun(node.get_left_child())
-                str += ')'
-        elif node.kind == 'processsubstitution':
-            assert(loose_constraints or node.get_num_of_children() == 1)
-            if lc and node.get_num_of_children() < 1:
-                str += ''
+                emit(' '.join(fragments).strip())
+                continue
+            push(len(parts))
+            emit(' '.join(fragments) + ' ')
+            for child in reversed(children[i:]):
+                push(' ')
+                push(child)
+        elif kind == 'root':
+            assert(lc or len(children) == 1)
+            if lc:
+                stack.extend(reversed(children))
             else:
-                str += '{}('.format(node.value)
-                str += to_command_fun(node.get_left_child())
-                str += ')'
-        elif node.is_utility():
-            str += node.value + ' '
-            children = sorted(node.children, key=lambda x:x.value) \
-                if ifo else node.children
-            for child in children:
-                str += to_command_fun(child) + ' '
-            str = str.strip()
-        elif node.is_option():
-            assert(loose_constraints or node.parent)
-            if '::' in node.value:
-                value, op = node.value.split('::')
-                str += value + ' '
+                push(children[0])
+        elif kind == 'pipeline':
+            assert(lc or len(children) > 1)
+            if lc and len(children) < 2:
+                stack.extend(children)
             else:
-                arg_connector = '=' if (node.is_long_option() and
-                                        node.children) else ' '
-                str += node.value + arg_connector
-            for child in node.children:
-                str += to_command_fun(child) + ' '
-            if '::' in node.value:
-                if op == ';':
-                    op = "\\;"
-                str += op + ' '
-            str = str.strip()
-        elif node.kind == 'operator':
-            str += '--'
-        elif node.kind == "binarylogicop":
-            assert(loose_constraints or node.get_num_of_children() == 0)
-            if lc and node.get_num_of_children() > 0:
-                for child in node.children[:-1]:
-                    str += to_command_fun(child) + ' '
-                    str += node.value + ' '
-                str += to_command_fun(node.children[-1])
-                str = str.strip()
+                push(children[-1])
+                for child in reversed(children[:-1]):
+                    push(' | ')
+                    push(child)
+        elif kind == 'commandsubstitution' or kind == 'processsubstitution':
+            assert(lc or len(children) == 1)
+            if children:
+                emit('$(' if kind == 'commandsubstitution'
+                             else '{}('.format(node.value))
+                push(')')
+                push(children[0])
+        elif kind == 'operator':
+            emit('--')
+        elif kind == 'binarylogicop':
+            assert(lc or not children)
+            if lc and children:
+                push(len(parts))
+                push(children[-1])
+                separator = ' {} '.format(node.value)
+                for child in reversed(children[:-1]):
+                    push(separator)
+                    push(child)
             else:
-                str += node.value
-        elif node.kind == "unarylogicop":
-            assert(loose_constraints or node.get_num_of_children() == 0)
-            if lc and node.get_num_of_children() > 0:
+                emit(node.value)
+        elif kind == 'unarylogicop':
+            assert(lc or not children)
+            if lc and children:
                 if node.associate == UnaryLogicOpNode.RIGHT:
-                    str += '{} {}'.format(
-                        node.value, to_command_fun(node.get_left_child()))
+                    emit(node.value + ' ')
                 else:
-                    str += '{} {}'.format(
-                        to_command_fun(node.get_left_child()), node.value)
+                    push(' ' + node.value)
+                push(children[0])
             else:
-                str += node.value
-        elif node.kind == "bracket":
-            assert(loose_constraints or node.get_num_of_children() >= 1)
-            if lc and node.get_num_of_children() < 2:
-                for child in node.children:
-                    str += to_command_fun(child)
+                emit(node.value)
+        elif kind == 'bracket':
+            assert(lc or children)
+            if lc and len(children) < 2:
+                stack.extend(reversed(children))
             else:
-                str += "\\( "
-                for i in xrange(len(node.children)):
-                    str += to_command_fun(node.children[i]) + ' '
-                str += "\\)"
-        elif node.is_argument():
-            assert(loose_constraints or node.get_num_of_children() == 0)
-            str += node.value
-            if lc:
-                for child in node.children:
-                    str += to_command_fun(child)
-        return str
-
-    return to_command_fun(node)
+                emit("\\( ")
+                push("\\)")
+                for child in reversed(children):
+                    push(' ')
+                    push(child)
+    return ''.join(parts)
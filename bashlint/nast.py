@@ -3,11 +3,15 @@ Node Classes for the Normalized Bash AST.
 """
 
 import collections
+import copy
 
 from bashlint import bash
 
 KIND_PREFIX = '<KIND_PREFIX>'
 
+# node kind -> kind prefix
+_kind_prefixes = {}
+
 
 def make_parent_child(parent, child):
     parent.add_child(child)
@@ -20,6 +24,9 @@ def make_sibling(lsb, rsb):
         rsb.lsb = lsb
 
 class Node(object):
+    # per-node attributes are kept in slots instead of an instance dict
+    __slots__ = ('parent', 'lsb', 'rsb', 'kind', 'value', 'children')
+
     num_child = -1          # number of children taken by node
                             # -1 indicates "any number of"
     children_types = []     # list of compatible types of children
@@ -107,17 +114,24 @@ class Node(object):
         return self.kind == "root"
 
     def remove_child(self, child):
-        if child in self.children:
+        try:
             self.children.remove(child)
+        except ValueError:
+            pass
 
     def remove_child_by_index(self, index):
         self.children.pop(index)
 
+    def remove_children(self, children):
+        # drop a batch of children in a single pass over the child list
+        removed = set(id(child) for child in children)
+        self.children[:] = [child for child in self.children
+                            if id(child) not in removed]
+
     def replace_child(self, child, new_child):
         new_child.parent = child.parent
         index = self.children.index(child)
-        self.remove_child(child)
-        self.children.insert(index, new_child)
+        self.children[index] = new_child
         make_sibling(child.lsb, new_child)
         make_sibling(new_child, child.rsb)
 
@@ -128,14 +142,52 @@ class Node(object):
         make_sibling(lp.lsb, new_child)
         make_sibling(new_child, rp.rsb)
         index = self.children.index(lp)
-        self.remove_child(lp)
+        self.children[index] = new_child
         self.remove_child(rp)
-        self.children.insert(index, new_child)
         return index
 
+    def clone(self):
+        """
+        Copy the node together with all nodes linked to it.
+
+        The copy is made with an explicit stack, as copy.deepcopy follows the
+        parent and sibling links recursively and overflows the call stack on
+        commands with a few hundred nodes.
+        """
+        clones = {}
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if id(node) in clones:
+                continue
+            clones[id(node)] = (node, copy.copy(node))
+            for linked in (node.parent, node.lsb, node.rsb):
+                if linked is not None:
+                    stack.append(linked)
+            stack.extend(node.children)
+
+        def cloned(node):
+            return None if node is None else clones[id(node)][1]
+
+        for node, clone in clones.values():
+            clone.parent = cloned(node.parent)
+            clone.lsb = cloned(node.lsb)
+            clone.rsb = cloned(node.rsb)
+            clone.children = [cloned(child) for child in node.children]
+            if isinstance(node, UtilityNode):
+                clone.arg_dict = dict(
+                    (key, collections.defaultdict(int, counts))
+                    for key, counts in node.arg_dict.items())
+            elif isinstance(node, ArgumentNode) and node.list_members:
+                clone.list_members = list(node.list_members)
+        return cloned(self)
+
     @property
     def prefix(self):
-        return self.kind.upper() + KIND_PREFIX
+        prefix = _kind_prefixes.get(self.kind)
+        if prefix is None:
+            prefix = _kind_prefixes[self.kind] = self.kind.upper() + KIND_PREFIX
+        return prefix
 
     @property
     def symbol(self):
@@ -156,6 +208,8 @@ class Node(object):
         return self.parent.parent
 
 class UtilityNode(Node):
+    __slots__ = ('arg_dict',)
+
     def __init__(self, value='', parent=None, lsb=None):
         super(UtilityNode, self).__init__(parent, lsb, "utility", value)
         self.arg_dict = {'': collections.defaultdict(int)}
@@ -180,6 +234,8 @@ class UtilityNode(Node):
                 return child
 
 class FlagNode(Node):
+    __slots__ = ()
+
     def __init__(self, value='', parent=None, lsb=None):
         super(FlagNode, self).__init__(parent, lsb, "flag", value)
 
@@ -202,6 +258,8 @@ class FlagNode(Node):
         return self.value.startswith('--')
 
 class ArgumentNode(Node):
+    __slots__ = ('arg_type', 'index', 'list_separator', 'list_members')
+
     num_child = 0
 
     def __init__(self, value='', arg_type='', parent=None, lsb=None,
@@ -247,6 +305,8 @@ class ArgumentNode(Node):
         self.index = ind
 
 class OperatorNode(Node):
+    __slots__ = ()
+
     num_child = 0
 
     def __init__(self, value='', parent=None, lsb=None):
@@ -254,6 +314,8 @@ class OperatorNode(Node):
             parent, lsb, kind='operator', value=value)
 
 class UnaryLogicOpNode(Node):
+    __slots__ = ('associate',)
+
     num_child = 1
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
     LEFT = 0
@@ -269,6 +331,8 @@ class UnaryLogicOpNode(Node):
             raise ValueError("Unrecognized unary logic operator: {}".format(value))
 
 class BinaryLogicOpNode(Node):
+    __slots__ = ()
+
     num_child = -1
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
 
@@ -276,6 +340,8 @@ class BinaryLogicOpNode(Node):
         super(BinaryLogicOpNode, self).__init__(parent, lsb, 'binarylogicop', value)
 
 class BracketNode(Node):
+    __slots__ = ()
+
     num_child = -1
     children_types = [set(['flag', 'bracket', 'unarylogicop', 'binarylogicop'])]
 
@@ -283,18 +349,24 @@ class BracketNode(Node):
         super(BracketNode, self).__init__(parent, lsb, 'bracket', '')
 
 class RedirectNode(Node):
+    __slots__ = ()
+
     num_child = 2
 
     def __init__(self, value='', parent=None, lsb=None):
         super(RedirectNode, self).__init__(parent, lsb, 'redirect', value)
 
 class PipelineNode(Node):
+    __slots__ = ()
+
     children_types = [set(['utility'])]
 
     def __init__(self, parent=None, lsb=None):
         super(PipelineNode, self).__init__(parent, lsb, 'pipeline')
 
 class CommandSubstitutionNode(Node):
+    __slots__ = ()
+
     num_child = 1
     children_types = [set(['pipe', 'utility'])]
 
@@ -303,6 +375,8 @@ class CommandSubstitutionNode(Node):
         self.kind = "commandsubstitution"
 
 class ProcessSubstitutionNode(Node):
+    __slots__ = ()
+
     num_child = 1
     children_types = [set(['pipe', 'utility'])]
 
@@ -54,8 +54,70 @@ def test_bash_tokenizer():
     test(cmd3)
 
 
+def test_long_commands():
+    # the memoized trees are copied on every call, which must not overflow
+    # the call stack on long commands
+    cmd1 = 'find . ' + ' -o '.join('-name "*.x%d"' % i for i in range(120))
+    cmd2 = 'echo ' + ' '.join('a%d' % i for i in range(500))
+    for cmd in [cmd1, cmd2]:
+        ast = bash_parser(cmd)
+        assert(ast is not None)
+        assert(ast is not bash_parser(cmd))
+        assert(ast2command(ast) == ast2command(bash_parser(cmd)))
+    print('long commands: ok')
+
+
+def test_memoized_ast_isolation():
+    # the parser hands out copies of its memoized trees, changing a returned
+    # tree in place (as the slot filler does) must not leak into later calls
+    cmd = 'find . -name "*.txt" -mtime +7 -exec rm {} \\;'
+    ast = bash_parser(cmd)
+    expected = ast2command(ast)
+    stack = [ast]
+    while stack:
+        node = stack.pop()
+        if node.is_argument():
+            node.value = '_SLOT_'
+        stack.extend(node.children)
+    assert(ast2command(ast) != expected)
+    assert(ast2command(bash_parser(cmd)) == expected)
+    print('memoized ast isolation: ok')
+
+
+def test_ast2ids():
+    ast1 = bash_parser('find . -name "*.txt" | xargs -I {} grep -l foo {}')
+    ast2 = bash_parser('ls -l /tmp')
+    for ast in [ast1, ast2]:
+        for kwargs in [{}, {'arg_type_only': True, 'with_prefix': True,
+                            'with_flag_head': True, 'ignore_flag_order': True}]:
+            tokens = ast2list(ast, **kwargs)
+            vocab = dict((token, i) for i, token in enumerate(set(tokens)))
+            ids = ast2ids(ast, vocab, unk_id=-1, **kwargs)
+            assert(list(ids) == [vocab[token] for token in tokens])
+
+    # unknown tokens grow the vocabulary unless unk_id is set
+    vocab = {}
+    ids = ast2ids(ast2, vocab)
+    assert(list(ids) == [vocab[token] for token in ast2list(ast2)])
+    assert(len(vocab) == len(set(ast2list(ast2))))
+    known = {'find': 0}
+    ids = ast2ids(ast1, known, unk_id=2)
+    assert(list(ids) == [0 if token == 'find' else 2
+                         for token in ast2list(ast1)])
+    assert(known == {'find': 0})
+
+    # _ids accumulates across trees
+    ids = ast2ids(ast1, vocab)
+    ast2ids(ast2, vocab, _ids=ids)
+    assert(list(ids) == list(ast2ids(ast1, vocab)) + list(ast2ids(ast2, vocab)))
+    print('ast2ids: ok')
+
+
 if __name__ == "__main__":
     # input_file = sys.argv[1]
     # batch_parse(input_file)
     # test_bash_parser()
-    test_bash_tokenizer()
\ No newline at end of file
+    test_bash_tokenizer()
+    test_long_commands()
+    test_memoized_ast_isolation()
+    test_ast2ids()
\ No newline at end of file
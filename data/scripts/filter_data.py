@@ -8,6 +8,7 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import multiprocessing
 import os, sys
 
 from bashlint import bash, bash_parser, get_utilities
@@ -18,17 +19,29 @@ MAX_TEXT_LENGTH = 50
 NUM_UTILITIES = 100
 
 
-def compute_top_utilities(path, k):
+def command_utilities(cm):
+    """
+    Return the set of utilities used in a command, or None if the command
+    cannot be parsed.
+    """
+    ast = bash_parser(cm, verbose=False)
+    if ast is None:
+        return None
+    return get_utilities(ast)
+
+
+def parallel_command_utilities(cms):
+    # the commands are parsed independently of each other
+    with multiprocessing.Pool() as pool:
+        return pool.map(command_utilities, cms, chunksize=256)
+
+
+def compute_top_utilities(cm_utilities, k):
     print('computing top most frequent utilities...') 
     utilities = collections.defaultdict(int)
-    with open(path, encoding='utf-8') as f:
-        while (True):
-            command = f.readline().strip()
-            if not command:
-                break
-            ast = bash_parser(command, verbose=False)
-            for u in get_utilities(ast):
-                utilities[u] += 1
+    for command_uts in cm_utilities:
+        for u in command_uts or []:
+            utilities[u] += 1
     top_utilities = []
 
     freq_threshold = -1   
@@ -46,8 +59,8 @@ def compute_top_utilities(path, k):
 
 
 def filter_by_most_frequent_utilities(data_dir, num_utilities):
-    def select(ast, cm, utility_set):
-        for ut in get_utilities(ast):
+    def select(uts, cm, utility_set):
+        for ut in uts:
             if not ut in utility_set:
                 print('Utility currently not handled: {} - {}'.format(ut, cm.encode('utf-8')))
                 return False
@@ -55,21 +68,21 @@ def filter_by_most_frequent_utilities(data_dir, num_utilities):
 
     nl_path = os.path.join(data_dir, 'all.nl')
     cm_path = os.path.join(data_dir, 'all.cm')
-    top_utilities = compute_top_utilities(cm_path, num_utilities)
     with open(nl_path, encoding='utf-8') as f:
         nls = [nl.strip() for nl in f.readlines()]
     with open(cm_path, encoding='utf-8') as f:
         cms = [cm.strip() for cm in f.readlines()]
+    cm_utilities = parallel_command_utilities(cms)
+    top_utilities = compute_top_utilities(cm_utilities, num_utilities)
     nl_outfile_path = os.path.join(data_dir, 'all.nl.filtered')
     cm_outfile_path = os.path.join(data_dir, 'all.cm.filtered')
     with open(nl_outfile_path, 'w', encoding='utf-8') as nl_outfile:
         with open(cm_outfile_path, 'w', encoding='utf-8') as cm_outfile:
-            for nl, cm in zip(nls, cms):
+            for nl, cm, uts in zip(nls, cms, cm_utilities):
                 if len(nl.split()) > MAX_TEXT_LENGTH:
                     print('lenthy description skipped: {}'.format(nl))
                     continue
-                ast = bash_parser(cm)
-                if ast and select(ast, cm, top_utilities):
+                if uts is not None and select(uts, cm, top_utilities):
                     nl_outfile.write('{}\n'.format(nl))
                     cm_outfile.write('{}\n'.format(cm))
 
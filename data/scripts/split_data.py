@@ -10,6 +10,8 @@ from __future__ import print_function
 
 import collections
 import json
+import multiprocessing
+import numpy as np
 import random
 import re
 import os, sys
@@ -17,9 +19,9 @@ import os, sys
 from data_processor.data_utils import DataSet, ExampleGroup, Example
 from nlp_tools import canonicalize_text
 
-html_rel2abs = re.compile('"/[^\s<>]*/*http')
+html_rel2abs = re.compile(r'"/[^\s<>]*/*http')
 hypothes_header = re.compile(
-    '\<\!\-\- WB Insert \-\-\>.*\<\!\-\- End WB Insert \-\-\>', re.DOTALL)
+    r'\<\!\-\- WB Insert \-\-\>.*\<\!\-\- End WB Insert \-\-\>', re.DOTALL)
 
 RANDOM_SEED = 100
 
@@ -28,68 +30,65 @@ def split_data(data_dir):
     nl_file_path = os.path.join(data_dir, 'all.nl.filtered')
     cm_file_path = os.path.join(data_dir, 'all.cm.filtered')
     with open(nl_file_path, encoding='utf-8') as f:
-        nls = [line.strip() for line in f.readlines()]
+        nls = [line.strip() for line in f]
     with open(cm_file_path, encoding='utf-8') as f:
-        cms = [line.strip() for line in f.readlines()]
+        cms = [line.strip() for line in f]
     assert(len(nls) == len(cms))
 
+    # canonicalize each distinct natural language description only once
+    distinct_nls = list(collections.OrderedDict.fromkeys(nls))
+    with multiprocessing.Pool() as pool:
+        nl_temps = dict(zip(distinct_nls, pool.map(
+            canonicalize_text, distinct_nls, chunksize=256)))
     pairs = collections.defaultdict(list)
     for nl, cm in zip(nls, cms):
-        nl_temp = canonicalize_text(nl)
-        pairs[nl_temp].append((nl, cm))
+        pairs[nl_temps[nl]].append((nl, cm))
 
     train, dev, test = collections.defaultdict(list), collections.defaultdict(list), collections.defaultdict(list)
     num_folds = 12
-    num_train, num_dev, num_test = 0, 0, 0
 
     # randomly split data according to ratio
     random.seed(RANDOM_SEED)
     random_tokens = [random.randint(0, num_folds-1) for i in range(len(pairs.keys()))]
     with open(os.path.join(data_dir, 'random_tokens.txt'), 'w') as o_f:
-        for r_token in random_tokens:
-            o_f.write('{}\n'.format(r_token))
+        o_f.write(''.join('{}\n'.format(r_token) for r_token in random_tokens))
 
+    # dispatch the templates to the three splits by fold mask
+    templates = sorted(pairs.keys())
+    folds = np.array(random_tokens, dtype=np.int64)
     train_commands = set()
-    for i, nl_temp in enumerate(sorted(pairs.keys())):
-        ind = random_tokens[i]
-        if ind < num_folds - 2:
-            train[nl_temp] = pairs[nl_temp]
-            num_train += 1
-            for _, cm in pairs[nl_temp]:
-                train_commands.add(cm)
-        elif ind == num_folds - 2:
-            dev[nl_temp] = pairs[nl_temp]
-            num_dev += 1
-        elif ind == num_folds - 1:
-            test[nl_temp] = pairs[nl_temp]
-            num_test += 1
+    for i in np.nonzero(folds < num_folds - 2)[0]:
+        nl_temp = templates[i]
+        train[nl_temp] = pairs[nl_temp]
+        train_commands.update(cm for _, cm in pairs[nl_temp])
+    for i in np.nonzero(folds == num_folds - 2)[0]:
+        dev[templates[i]] = pairs[templates[i]]
+    for i in np.nonzero(folds == num_folds - 1)[0]:
+        test[templates[i]] = pairs[templates[i]]
     print('First round split:')
     print('train - {} pairs, dev - {} pairs, test - {} pairs'.format(
         len(train), len(dev), len(test)))
 
     # move dev/test examples whose command has appeared in the train set to 
     # train
-    dev_cleaned = collections.defaultdict(list)
-    num_moved = 0
-    for nl_temp in dev:
-        for nl, cm in dev[nl_temp]:
-            if cm in train_commands:
-                train[nl_temp].append((nl, cm))
-                num_moved += 1
-            else:
-                dev_cleaned[nl_temp].append((nl, cm))
-    print('{} pairs moved from dev to train'.format(num_moved))
-
-    test_cleaned = collections.defaultdict(list)
-    num_moved = 0
-    for nl_temp in test:
-        for nl, cm in test[nl_temp]:
-            if cm in train_commands:
-                train[nl_temp].append((nl, cm))
-                num_moved += 1
-            else:
-                test_cleaned[nl_temp].append((nl, cm))
-    print('{} pairs moved from test to train'.format(num_moved))
+    def move_to_train(data_split, split_name):
+        data_split_cleaned = collections.defaultdict(list)
+        num_moved = 0
+        for nl_temp in data_split:
+            moved = [pair for pair in data_split[nl_temp]
+                     if pair[1] in train_commands]
+            kept = [pair for pair in data_split[nl_temp]
+                    if pair[1] not in train_commands]
+            if moved:
+                train[nl_temp].extend(moved)
+                num_moved += len(moved)
+            if kept:
+                data_split_cleaned[nl_temp] = kept
+        print('{} pairs moved from {} to train'.format(num_moved, split_name))
+        return data_split_cleaned
+
+    dev_cleaned = move_to_train(dev, 'dev')
+    test_cleaned = move_to_train(test, 'test')
     print('Second round split:')
     print('train - {} pairs, dev - {} pairs, test - {} pairs'.format(
         len(train), len(dev_cleaned), len(test_cleaned)))
@@ -106,7 +105,8 @@ def split_data(data_dir):
         # import pdb
         # pdb.set_trace()
         with open(out_json, 'w') as o_f:
-            json.dump(dataset, o_f, indent=4, default=lambda x: x.__dict__)
+            o_f.write(json.dumps(
+                dataset, indent=4, default=lambda x: x.__dict__))
 
     save_data_split(train, os.path.join(data_dir, "train.filtered.json"))
     save_data_split(dev_cleaned, os.path.join(data_dir, "dev.filtered.json"))
@@ -11,6 +11,8 @@ import re
 
 from . import constants
 
+_DIGIT_RE = re.compile(constants._DIGIT_RE)
+
 def decorate_boundaries(r):
     """
     Match named entity boundary characters s.a. quotations and whitespaces.
@@ -176,4 +178,7 @@ def annotate_ner(pattern, category, sentence, entities):
     return sentence
 
 def normalize_number_in_token(token):
-    return re.sub(re.compile(constants._DIGIT_RE), constants._NUMBER, token)
+    # most tokens contain no digit, skip the regex engine for those
+    if not any(c.isdigit() for c in token):
+        return token
+    return re.sub(_DIGIT_RE, constants._NUMBER, token)